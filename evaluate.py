@@ -0,0 +1,300 @@
+"""
+Offline replay of the rating history against scoring engines
+
+The ratings are replayed in the order they were given. Every eval_every
+ratings the engine ranks the next window of ratings, using a model trained on
+the ratings before it. Like the UserInterface, the model is only retrained
+every retrain_every ratings, so a slow retrain cadence is measured with the
+stale model it would serve.
+
+Each configuration runs in its own process and reports NDCG of the liked items
+in the ranked window next to fit, predict and rank latency. Only the models an
+evaluation uses are fit, so the fit cost per rating is amortized from the mean
+fit time. Every replay is seeded, so repeated runs give the same rankings. The
+worker processes are limited to one BLAS thread each so the configurations
+don't compete for cores in the timings. Run with --workers 1 for the cleanest
+latency numbers.
+
+UserInterface.REFILL_THRESHOLD and REFILL_TARGET aren't replayed. They only set
+how many records are fetched at once, and retraining is set by retrain_every,
+which is replayed.
+
+python evaluate.py [abstract_stream or abstract_stream.json] [--workers N]
+"""
+
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import numpy as np
+
+from threadpoolctl import threadpool_limits
+
+from storage import LEGACY_PATH, STORE_DIR, ShardStore, read_legacy
+from tfidf import TrainingBudget, fit, predict
+
+LIKED = 3
+
+
+class TfidfEngine(object):
+    def __init__(
+        self,
+        max_df=0.5,
+        min_df=5,
+        tol=1e-2,
+        solver="sparse_cg",
+        max_examples=None,
+        sampling="reservoir",
+        half_life=None,
+        seed=0,
+    ):
+        self.fit_args = {
+            "max_df": max_df,
+            "min_df": min_df,
+            "tol": tol,
+            "solver": solver,
+            "quiet": True,
+            "budget": TrainingBudget(
+                max_examples=max_examples,
+                sampling=sampling,
+                half_life=half_life,
+                seed=seed,
+            ),
+        }
+        self.model = None
+
+    def fit(self, rated_items):
+        self.model = fit(rated_items, **self.fit_args)
+
+    def predict(self, items):
+        return predict(self.model, items)
+
+
+class RandomEngine(object):
+    """
+    The explore() ranking, as a baseline
+    """
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+
+    def fit(self, rated_items):
+        pass
+
+    def predict(self, items):
+        return [self.rng.random() for _ in items]
+
+
+ENGINES = {
+    "tfidf": TfidfEngine,
+    "random": RandomEngine,
+}
+
+"""
+Each configuration is the engine name, the engine's keyword arguments and how
+many ratings are given between retrains
+"""
+DEFAULT_CONFIGS = [
+    {"engine": "random", "args": {}, "retrain_every": 10},
+    {"engine": "tfidf", "args": {}, "retrain_every": 10},
+    {"engine": "tfidf", "args": {}, "retrain_every": 5},
+    {"engine": "tfidf", "args": {}, "retrain_every": 25},
+    {"engine": "tfidf", "args": {"max_df": 0.8, "min_df": 2}, "retrain_every": 10},
+    {"engine": "tfidf", "args": {"max_df": 0.3, "min_df": 10}, "retrain_every": 10},
+    {"engine": "tfidf", "args": {"tol": 1e-3}, "retrain_every": 10},
+    {"engine": "tfidf", "args": {"solver": "lsqr"}, "retrain_every": 10},
+    {
+        "engine": "tfidf",
+        "args": {"max_examples": 2000, "sampling": "stratified", "half_life": 1000},
+        "retrain_every": 10,
+    },
+]
+
+
+def ndcg(relevance, k):
+    """
+    NDCG@k of relevance listed in ranked order, None if nothing is relevant
+    """
+    relevance = np.asarray(relevance, dtype=float)
+    discounts = 1.0 / np.log2(np.arange(2, min(k, len(relevance)) + 2))
+
+    ideal = np.sort(relevance)[::-1][:k]
+    ideal_dcg = float((ideal * discounts).sum())
+    if ideal_dcg == 0.0:
+        return None
+
+    return float((relevance[:k] * discounts).sum()) / ideal_dcg
+
+
+def _unrated(item):
+    return {"id": item["id"], "title": item["title"], "abstract": item["abstract"]}
+
+
+def replay(
+    rated_items, config, *, warmup=50, window=20, eval_every=10, k=10, seed=0
+):
+    """
+    Replay rated_items (oldest rating first) against one configuration
+    """
+    engine = ENGINES[config["engine"]](**dict({"seed": seed}, **config["args"]))
+    retrain_every = config["retrain_every"]
+
+    fit_durations = []
+    predict_durations = []
+    rank_durations = []
+    scores = []
+    failures = 0
+
+    trained_at = None
+    for t in range(warmup, len(rated_items) - window + 1, eval_every):
+        retrain_point = warmup + (t - warmup) // retrain_every * retrain_every
+        if retrain_point != trained_at:
+            t0 = time()
+            try:
+                engine.fit(rated_items[:retrain_point])
+            except ValueError:
+                failures += 1
+                continue
+            fit_durations.append(time() - t0)
+            trained_at = retrain_point
+
+        candidates = rated_items[t : t + window]
+
+        t0 = time()
+        predicted = engine.predict([_unrated(i) for i in candidates])
+        predict_durations.append(time() - t0)
+
+        t0 = time()
+        ranked = sorted(
+            range(len(candidates)), key=lambda idx: predicted[idx], reverse=True
+        )
+        rank_durations.append(time() - t0)
+
+        score = ndcg(
+            [1.0 if candidates[idx]["rating"] == LIKED else 0.0 for idx in ranked], k
+        )
+        if score is not None:
+            scores.append(score)
+
+    fit_sec = float(np.mean(fit_durations)) if fit_durations else float("nan")
+    return {
+        "config": config,
+        "ndcg": float(np.mean(scores)) if scores else float("nan"),
+        "windows": len(scores),
+        "fits": len(fit_durations),
+        "failed_fits": failures,
+        "fit_sec": fit_sec,
+        # the models in between evaluations aren't fit, amortize instead
+        "fit_sec_per_rating": fit_sec / retrain_every,
+        "predict_sec": float(np.mean(predict_durations))
+        if predict_durations
+        else float("nan"),
+        "rank_sec": float(np.mean(rank_durations)) if rank_durations else float("nan"),
+    }
+
+
+def load_history(path):
+    if os.path.isdir(path):
+        store = ShardStore(path)
+        return store.read_rated(store.manifest())
+    return read_legacy(path)[0]
+
+
+_history = None
+
+
+def _init_worker(path):
+    global _history
+    _history = load_history(path)
+
+    # one thread per configuration, so the timings aren't shared cores
+    threadpool_limits(limits=1)
+
+
+def _replay_worker(args):
+    config, replay_args = args
+    return replay(_history, config, **replay_args)
+
+
+def evaluate(path, configs=None, *, workers=None, **replay_args):
+    """
+    Replay the history at path against each configuration in parallel
+    """
+    if configs is None:
+        configs = DEFAULT_CONFIGS
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(path,)
+    ) as pool:
+        results = list(
+            pool.map(_replay_worker, [(config, replay_args) for config in configs])
+        )
+
+    report(results)
+    return results
+
+
+def report(results):
+    print(
+        "config".ljust(80),
+        "ndcg".rjust(6),
+        "fits".rjust(5),
+        "fit ms".rjust(8),
+        "fit ms/rating".rjust(13),
+        "predict ms".rjust(10),
+        "rank ms".rjust(8),
+    )
+    # nan compares false both ways, so configurations without a score are
+    # sorted last explicitly
+    ranked = sorted(results, key=lambda r: (np.isnan(r["ndcg"]), -r["ndcg"]))
+    for result in ranked:
+        config = result["config"]
+        name = "%s every %d %r" % (
+            config["engine"],
+            config["retrain_every"],
+            config["args"],
+        )
+        print(
+            name.ljust(80),
+            f"{result['ndcg']:6.3f}",
+            f"{result['fits']:5d}",
+            f"{result['fit_sec'] * 1000:8.1f}",
+            f"{result['fit_sec_per_rating'] * 1000:13.2f}",
+            f"{result['predict_sec'] * 1000:10.2f}",
+            f"{result['rank_sec'] * 1000:8.3f}",
+        )
+        if result["failed_fits"]:
+            print("".ljust(80), f"{result['failed_fits']} fits failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default=STORE_DIR if os.path.isdir(STORE_DIR) else LEGACY_PATH,
+        help="abstract_stream directory or legacy abstract_stream.json",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--eval-every", type=int, default=10)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    evaluate(
+        args.path,
+        workers=args.workers,
+        warmup=args.warmup,
+        window=args.window,
+        eval_every=args.eval_every,
+        k=args.k,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
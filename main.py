@@ -10,8 +10,13 @@ import feedparser
 from collections import defaultdict, Counter
 import json
 import code
+import re
+import tempfile
+from difflib import SequenceMatcher
 
-from tfidf import tfidf_score
+from retrain import RetrainWorker
+from storage import LEGACY_PATH, ShardStore, read_legacy
+from tfidf import TrainingBudget, budget_report
 
 BASE_URL = "http://export.arxiv.org/api/query?"
 
@@ -89,6 +94,8 @@ class RenderRecord(object):
             yield ""
             yield self.record["title"]
             yield f"Scores: PRNG {self.record['prng_score']:.2f} TFIDF {self.record['tfidf_score']:.2f} Citation {self.record['citation_score']:.2f}"
+            if "revision_of" in self.record:
+                yield f"Revision of {self.record['revision_of']}, which you rated"
             yield ""
             yield from self.record["abstract"].split("\n")
             yield ""
@@ -105,6 +112,31 @@ class RenderRecord(object):
         return "\n".join(lines())
 
 
+class RenderPage(object):
+    ABSTRACT_PREVIEW = 300
+
+    def __init__(self, records):
+        self.records = records
+
+    def _preview(self, abstract):
+        abstract = " ".join(abstract.split())
+        if len(abstract) <= self.ABSTRACT_PREVIEW:
+            return abstract
+        return abstract[: self.ABSTRACT_PREVIEW].rsplit(" ", 1)[0] + " ..."
+
+    def __repr__(self):
+        def lines():
+            yield ""
+            for idx, record in enumerate(self.records, start=1):
+                yield f"{idx}. {record['title']}"
+                yield f"   Scores: PRNG {record['prng_score']:.2f} TFIDF {record['tfidf_score']:.2f} Citation {record['citation_score']:.2f}"
+                yield "   " + self._preview(record["abstract"])
+                yield ""
+            yield 'rate_batch("1l 2d 3s 4r") | d = dislike | s = skip | i = interested | r = read | l = liked'
+
+        return "\n".join(lines())
+
+
 class ArxivBaseProvider(object):
     MAX_RESULTS = 500
     WAIT_TIME = 3
@@ -194,28 +226,78 @@ def round_robin(iterator_map):
         yield from nexts
 
 
-def deduplicate(records, other_keys=None):
+ARXIV_VERSION = re.compile(r"v(\d+)$")
+
+
+def canonical_id(arxiv_id):
+    """
+    cs/0412050v1 -> cs/0412050
+    """
+    return ARXIV_VERSION.sub("", arxiv_id)
+
+
+def id_version(arxiv_id):
+    match = ARXIV_VERSION.search(arxiv_id)
+    if match is None:
+        return 0
+    return int(match.group(1))
+
+
+def record_key(record):
+    """
+    Records are compared by their canonical id, so a new version of a paper
+    matches the old one. Revisions surfaced on purpose keep their own version
+    """
+    if "revision_of" in record:
+        return record["id"]
+    return canonical_id(record["id"])
+
+
+def deduplicate(records, other_keys=None, key=record_key):
     if other_keys is None:
         other_keys = []
     unique_records = set(other_keys)
 
     for r in records:
-        if r["id"] not in unique_records:
-            unique_records.add(r["id"])
+        r_key = key(r)
+        if r_key not in unique_records:
+            unique_records.add(r_key)
             yield r
         else:
             print("deduplicate - %s" % (r["title"],))
 
 
+def discover_score(record):
+    return max(record["tfidf_score"], record["citation_score"])
+
+
 class UserInterface(object):
+    # refill the backlog once it's down to REFILL_THRESHOLD unrated records,
+    # until it has more than REFILL_TARGET
+    REFILL_THRESHOLD = 40
+    REFILL_TARGET = 50
+
+    RATINGS = {"d": -1, "i": 1, "r": 2, "l": 3}
+    BATCH_RATING = re.compile(r"^(\d+)([dsirl])$")
+    EVICTION_KEYS = {
+        "age": lambda record: record.get("fetched_at", 0.0),
+        "lru": lambda record: record.get("last_seen", record.get("fetched_at", 0.0)),
+    }
+
     def __init__(self, providers):
         self.providers = {p.name: p.records() for p in providers}
 
         self.rated_items = []
         self.unrated_items = []
         self.skipped_items = []
+        # manifest entries of the unrated shards on disk, and their canonical ids
+        self.deferred_shards = []
+        self.deferred_ids = set()
 
         self.active_item = None
+        self.triage_page = []
+
+        self.storage = ShardStore()
 
         self.mark_as_interested = PrintTrigger(
             "mark_as_interested", self._mark_as_interested
@@ -226,14 +308,81 @@ class UserInterface(object):
 
         self.sort_key = lambda record: record["prng_score"]
 
+        # every rating, uniformly weighted. See budget_report() before capping
+        self.training_budget = TrainingBudget()
+
+        # retrain in the background after this many new ratings
+        self.retrain_every = 5
+        self.rescore_needed = False
+        self.retrainer = RetrainWorker()
+
+        # canonical arXiv id -> latest versioned id seen
+        self.versions = {}
+        # show a new version of a rated paper when its abstract is less than
+        # revision_similarity similar to the rated version
+        self.surface_revisions = False
+        self.revision_similarity = 0.8
+
+        # at most backlog_limit unrated records are kept in memory, the rest
+        # are spilled to disk by eviction_policy: "score" keeps the top by
+        # discover_score, "age" the most recently fetched and "lru" the most
+        # recently shown. Set with configure_backlog()
+        self._backlog_limit = 2000
+        self._spill_batch = 200
+        self._eviction_policy = "score"
+        # shards on disk to score with each retrain
+        self.rescore_shards = 2
+        self._rescore_cursor = 0
+
+    @property
+    def backlog_limit(self):
+        return self._backlog_limit
+
+    @property
+    def spill_batch(self):
+        return self._spill_batch
+
+    @property
+    def eviction_policy(self):
+        return self._eviction_policy
+
+    def configure_backlog(
+        self, *, backlog_limit=None, spill_batch=None, eviction_policy=None
+    ):
+        """
+        Change the in-memory backlog limit, spill batch or eviction policy.
+        Settings left as None are kept
+        """
+        if backlog_limit is None:
+            backlog_limit = self._backlog_limit
+        if spill_batch is None:
+            spill_batch = self._spill_batch
+        if eviction_policy is None:
+            eviction_policy = self._eviction_policy
+
+        if backlog_limit <= self.REFILL_TARGET + spill_batch:
+            raise ValueError(
+                "backlog_limit %d has to be more than REFILL_TARGET + spill_batch"
+                " (%d), or _refill reads spilled records straight back in"
+                % (backlog_limit, self.REFILL_TARGET + spill_batch)
+            )
+        if eviction_policy != "score" and eviction_policy not in self.EVICTION_KEYS:
+            raise ValueError("Unknown eviction_policy %r" % (eviction_policy,))
+
+        self._backlog_limit = backlog_limit
+        self._spill_batch = spill_batch
+        self._eviction_policy = eviction_policy
+
     def stats(self):
         print(
-            "%d rated, %d active, %d unrated, %d skipped"
+            "%d rated, %d active, %d on the triage page, %d unrated, %d skipped, %d unrated on disk"
             % (
                 len(self.rated_items),
                 1 if self.active_item is not None else 0,
+                len(self.triage_page),
                 len(self.unrated_items),
                 len(self.skipped_items),
+                self._deferred_count(),
             )
         )
         count = Counter((r["rating"] for r in self.rated_items))
@@ -243,44 +392,114 @@ class UserInterface(object):
         )
 
     @track_usage
-    def load(self):
-        try:
-            with open("abstract_stream.json", "r") as f:
-                py_version = json.load(f)
+    def load(self, *, backlog_shards=1):
+        """
+        Load the ratings and the top backlog_shards shards of the backlog. The
+        rest of the backlog stays on disk until _refill needs it
+        """
+        migrate_legacy = False
+        if self.storage.exists():
+            manifest = self.storage.manifest()
+            rated_items = self.storage.read_rated(manifest)
+            unrated_items = []
+            for entry in manifest["unrated"][:backlog_shards]:
+                unrated_items.extend(self.storage.read_shard(entry))
+            deferred_shards = manifest["unrated"][backlog_shards:]
+        else:
+            try:
+                rated_items, unrated_items = read_legacy()
+            except FileNotFoundError:
+                return
+            deferred_shards = []
+            migrate_legacy = True
 
-            self.active_item = None
-            self.rated_items = py_version["rated_items"]
-            self.rated_items = list(deduplicate(self.rated_items))
-
-            self.unrated_items = py_version["unrated_items"]
-            print('unrated items before deduplication', len(self.unrated_items))
-            self.unrated_items = list(
-                deduplicate(
-                    self.unrated_items, other_keys=(r["id"] for r in self.rated_items)
-                )
-            )
-            print(
-                f"Loaded {len(self.rated_items)} ratings and {len(self.unrated_items)} unrated records"
+        self.active_item = None
+        self.triage_page = []
+        self._set_deferred(deferred_shards)
+        self._rescore_cursor = 0
+        # Every version of a paper keeps its rating, only exact repeats are
+        # dropped. Canonical ids only dedup the backlog against the ratings
+        self.rated_items = list(deduplicate(rated_items, key=lambda r: r["id"]))
+
+        self.unrated_items = unrated_items
+        print('unrated items before deduplication', len(self.unrated_items))
+        self.unrated_items = list(
+            deduplicate(
+                self.unrated_items, other_keys=(record_key(r) for r in self.rated_items)
             )
-        except FileNotFoundError:
-            pass
+        )
+
+        self.versions = {}
+        self._index_versions(r["id"] for r in self.rated_items + self.unrated_items)
+        for entry in self.deferred_shards:
+            self._index_versions(entry["ids"])
+        print(
+            f"Loaded {len(self.rated_items)} ratings and {len(self.unrated_items)} unrated records, {self._deferred_count()} unrated records left on disk"
+        )
+
+        if migrate_legacy:
+            print("Migrating %s to %s" % (LEGACY_PATH, self.storage.path))
+            self.store()
+
+    @track_usage
+    def load_backlog(self):
+        """
+        Load the part of the backlog that load() left on disk
+        """
+        self._load_deferred(len(self.deferred_shards))
+
+    def _deferred_count(self):
+        return sum(entry["count"] for entry in self.deferred_shards)
+
+    def _set_deferred(self, entries):
+        self.deferred_shards = list(entries)
+        self.deferred_ids = set()
+        for entry in self.deferred_shards:
+            self.deferred_ids.update(canonical_id(arxiv_id) for arxiv_id in entry["ids"])
+
+    def _defer(self, entries):
+        for entry in entries:
+            self.deferred_shards.append(entry)
+            self.deferred_ids.update(canonical_id(arxiv_id) for arxiv_id in entry["ids"])
+
+    def _undefer(self, entry):
+        self.deferred_shards = [
+            deferred for deferred in self.deferred_shards if deferred is not entry
+        ]
+        self.deferred_ids.difference_update(
+            canonical_id(arxiv_id) for arxiv_id in entry["ids"]
+        )
+
+    def _load_deferred(self, shard_count):
+        viewed_set = self._viewed_set()
+
+        loaded = 0
+        for entry in self.deferred_shards[:shard_count]:
+            self._undefer(entry)
+            for record in deduplicate(
+                self.storage.read_shard(entry), other_keys=viewed_set
+            ):
+                viewed_set.add(record_key(record))
+                self.unrated_items.append(record)
+                loaded += 1
+
+        self.rescore_needed = True
+        print(f"Loaded {loaded} unrated records from disk")
 
     @track_usage
     def store(self):
         start = datetime.datetime.now()
-        unrated_to_store =(
-                    ([self.active_item]
-                    if self.active_item is not None
-                    else []) + self.unrated_items + self.skipped_items
-                )
-        string_version = json.dumps(
-            {
-                "rated_items": self.rated_items,
-                "unrated_items": unrated_to_store,
-            }
+        # Ranked for discover() whatever the active sort, so the first shard that
+        # load() reads is the top of the backlog
+        backlog = sorted(
+            self.triage_page + self.unrated_items, key=discover_score, reverse=True
         )
-        with open("abstract_stream.json", "w") as f:
-            f.write(string_version)
+        unrated_to_store = (
+            ([self.active_item] if self.active_item is not None else [])
+            + backlog
+            + self.skipped_items
+        )
+        self.storage.write(self.rated_items, unrated_to_store, self.deferred_shards)
 
         end = datetime.datetime.now()
         print("Stored records in %.2f sec" % ((end - start).total_seconds()))
@@ -290,9 +509,10 @@ class UserInterface(object):
         """
         return something that renders
         """
-        self.sort_key = lambda record: max(
-            record["tfidf_score"], record["citation_score"]
-        )
+        self.sort_key = discover_score
+
+        self.unrated_items.extend(self.triage_page)
+        self.triage_page = []
 
         if self.active_item is not None:
             self.unrated_items.append(self.active_item)
@@ -303,17 +523,115 @@ class UserInterface(object):
     def explore(self, *, store=True):
         self.sort_key = lambda record: record["prng_score"]
 
+        self.unrated_items.extend(self.triage_page)
+        self.triage_page = []
+
         if self.active_item is not None:
             self.unrated_items.append(self.active_item)
 
         return self._tick(store=store)
 
+    @track_usage
+    def triage(self, count=10, *, store=True):
+        """
+        Show a page of the top ranked records to be rated together with
+        rate_batch
+        """
+        self.sort_key = discover_score
+
+        if self.active_item is not None:
+            self.unrated_items.append(self.active_item)
+            self.active_item = None
+
+        self.unrated_items.extend(self.triage_page)
+        self.triage_page = []
+
+        return self._next_page(count, store=store)
+
+    @track_usage
+    def rate_batch(self, ratings):
+        """
+        Apply ratings like "1l 2d 3s 4r" to the current triage page, then
+        store, retrain and re-rank once for the whole batch
+        """
+        if not self.triage_page:
+            raise ValueError("No triage page to rate, call triage() first")
+
+        parsed = {}
+        for token in ratings.split():
+            match = self.BATCH_RATING.match(token.lower())
+            if match is None:
+                raise ValueError("Can't parse rating %r" % (token,))
+
+            index = int(match.group(1))
+            if not 1 <= index <= len(self.triage_page):
+                raise ValueError(
+                    "Rating %r is outside of the page 1-%d"
+                    % (token, len(self.triage_page))
+                )
+            if index - 1 in parsed:
+                raise ValueError("Record %d is rated more than once" % (index,))
+            parsed[index - 1] = match.group(2)
+
+        count = len(self.triage_page)
+        for index, record in enumerate(self.triage_page):
+            action = parsed.get(index)
+            if action is None:
+                self.unrated_items.append(record)
+            elif action == "s":
+                self.skipped_items.append(record)
+            else:
+                record["rating"] = self.RATINGS[action]
+                self.rated_items.append(record)
+        self.triage_page = []
+
+        self.store()
+
+        if len(self.unrated_items) <= self.REFILL_THRESHOLD:
+            self._refill()
+        # Retrain in the foreground so the next page is ranked with this batch
+        self._rerate()
+
+        return self._next_page(count, store=False)
+
+    def _next_page(self, count, *, store=True):
+        self._swap_scores()
+
+        if len(self.unrated_items) <= self.REFILL_THRESHOLD:
+            self._refill()
+            if store:
+                self.store()
+
+        self._evict()
+        self._schedule_retrain()
+
+        self.unrated_items.sort(
+            key=self.sort_key,
+            reverse=True,
+        )
+
+        self.triage_page, self.unrated_items = (
+            self.unrated_items[:count],
+            self.unrated_items[count:],
+        )
+
+        now = time.time()
+        for record in self.triage_page:
+            record["last_seen"] = now
+
+        return RenderPage(self.triage_page)
+
     def _tick(self, store=True):
-        if len(self.unrated_items) <= 40:
+        self._swap_scores()
+
+        if len(self.unrated_items) <= self.REFILL_THRESHOLD:
             self._refill()
             if store:
                 self.store()
 
+        self._evict()
+        self._schedule_retrain()
+
         self.unrated_items.sort(
             key=self.sort_key,
             reverse=True,
@@ -323,66 +641,309 @@ class UserInterface(object):
             self.unrated_items[0],
             self.unrated_items[1:],
         )
+        self.active_item["last_seen"] = time.time()
 
         return RenderRecord(self.active_item)
 
-    def _refill(self):
-        viewed_set = set(
-            [record["id"] for record in self.rated_items]
-            + [record["id"] for record in self.unrated_items]
-            + [record["id"] for record in self.skipped_items]
-            + ([self.active_item["id"]]
-            if self.active_item is not None
-            else [])
+    def _viewed_set(self):
+        """
+        Keys of the records in memory. Records on disk are in deferred_ids
+        """
+        return set(
+            [record_key(record) for record in self.rated_items]
+            + [record_key(record) for record in self._backlog()]
         )
+
+    def _index_versions(self, arxiv_ids):
+        for arxiv_id in arxiv_ids:
+            base = canonical_id(arxiv_id)
+            latest = self.versions.get(base)
+            if latest is None or id_version(arxiv_id) > id_version(latest):
+                self.versions[base] = arxiv_id
+
+    def _is_new_revision(self, record):
+        """
+        Record the latest version of an already seen paper. Returns True if it
+        should be shown again, because it's a substantial revision of a paper
+        that was rated and surface_revisions is set
+        """
+        base = canonical_id(record["id"])
+        latest = self.versions.get(base, record["id"])
+        if id_version(record["id"]) <= id_version(latest):
+            return False
+        self.versions[base] = record["id"]
+
+        if not self.surface_revisions:
+            return False
+
+        previous = None
+        for rated in reversed(self.rated_items):
+            if canonical_id(rated["id"]) == base:
+                previous = rated
+                break
+        if previous is None:
+            return False
+
+        similarity = SequenceMatcher(
+            None, previous["abstract"], record["abstract"]
+        ).ratio()
+        if similarity >= self.revision_similarity:
+            return False
+
+        print(
+            "Surfacing revision %s of %s (%.2f similar)"
+            % (record["id"], previous["id"], similarity)
+        )
+        record["revision_of"] = previous["id"]
+        return True
+
+    def _refill(self):
+        # Work through the backlog on disk before fetching more records
+        while self.deferred_shards and len(self.unrated_items) <= self.REFILL_TARGET:
+            self._load_deferred(1)
+
+        if len(self.unrated_items) > self.REFILL_TARGET:
+            return
+
+        viewed_set = self._viewed_set()
         print('viewed set before _refill', len(viewed_set))
 
         for record in round_robin(self.providers):
             assert isinstance(record, dict)
 
-            arxiv_id = record["id"]
-            if arxiv_id not in viewed_set:
+            record["fetched_at"] = time.time()
+
+            key = record_key(record)
+            if key not in viewed_set and key not in self.deferred_ids:
+                viewed_set.add(key)
+                self._index_versions([record["id"]])
+                self.unrated_items.append(record)
+            elif self._is_new_revision(record):
+                viewed_set.add(record_key(record))
                 self.unrated_items.append(record)
             else:
                 print("De-duplicating record. Title:", record["title"])
 
-            if len(self.unrated_items) > 50:
+            if len(self.unrated_items) > self.REFILL_TARGET:
                 print("Early refill pause")
                 break
 
-        self._rerate()
+        self.rescore_needed = True
+
+    def _backlog(self):
+        return (
+            ([self.active_item] if self.active_item is not None else [])
+            + self.triage_page
+            + self.unrated_items
+            + self.skipped_items
+        )
+
+    def _swap_scores(self):
+        """
+        Pick up the scores from a finished background retrain
+        """
+        swapped = self.retrainer.swap()
+        if swapped is None:
+            return
+        scores, rescored_shards = swapped
+
+        updated = 0
+        for record in self._backlog():
+            if record["id"] in scores:
+                record["tfidf_score"] = scores[record["id"]]
+                updated += 1
+        print(
+            "Updated %d unrated predictions from %d ratings"
+            % (updated, self.retrainer.trained_ratings)
+        )
+
+        self._promote(rescored_shards)
+
+    def _promote(self, rescored_shards):
+        """
+        Bring records the retrain scored on disk back into memory when they now
+        rank above records that are kept in memory, by discover_score like
+        _evict. Each one promoted displaces the lowest record left in memory,
+        so the next _evict spills that record and not the promoted one
+        """
+        if self.eviction_policy != "score":
+            return
+
+        candidates = []
+        for entry, records in rescored_shards:
+            if not any(entry is deferred for deferred in self.deferred_shards):
+                # loaded since the retrain started
+                continue
+            candidates.extend(
+                (discover_score(record), record, entry) for record in records
+            )
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        lowest = sorted(discover_score(record) for record in self.unrated_items)
+        promoted = []
+        for (score, record, entry), displaced in zip(candidates, lowest):
+            if score <= displaced:
+                break
+            promoted.append((record, entry))
+        if not promoted:
+            return
+
+        promoted_ids = set(id(record) for record, _ in promoted)
+        for entry, records in rescored_shards:
+            if not any(entry is promoted_entry for _, promoted_entry in promoted):
+                continue
+            # Rewrite the shard without the promoted records, with the new scores
+            self._undefer(entry)
+            self._defer(
+                self.storage.spill([r for r in records if id(r) not in promoted_ids])
+            )
+
+        added = 0
+        viewed_set = self._viewed_set()
+        for record in deduplicate(
+            [record for record, _ in promoted], other_keys=viewed_set
+        ):
+            self.unrated_items.append(record)
+            added += 1
+        print(f"Promoted {added} records from disk")
+
+    def _evict(self):
+        """
+        Keep backlog_limit unrated records in memory by eviction_policy. Once
+        the backlog is spill_batch over the limit the rest, and the skipped
+        records, are spilled to disk
+        """
+        backlog_size = len(self.unrated_items) + len(self.skipped_items)
+        if backlog_size <= self.backlog_limit + self.spill_batch:
+            return
+
+        if self.eviction_policy == "score":
+            # not sort_key, explore() ranks at random
+            eviction_key = discover_score
+        else:
+            eviction_key = self.EVICTION_KEYS[self.eviction_policy]
+
+        self.unrated_items.sort(key=eviction_key, reverse=True)
+        evicted = self.skipped_items + self.unrated_items[self.backlog_limit :]
+        self.unrated_items = self.unrated_items[: self.backlog_limit]
+        self.skipped_items = []
+
+        self._defer(self.storage.spill(evicted))
+        print(f"Evicted {len(evicted)} records to disk")
+
+    def _start_retrain(self):
+        # Score a few shards on disk with each retrain, rotating through them,
+        # so records that now rank highly can be promoted back into memory
+        shards = self.deferred_shards[
+            self._rescore_cursor : self._rescore_cursor + self.rescore_shards
+        ]
+        if not self.retrainer.start(
+            self.rated_items,
+            self._backlog(),
+            budget=self.training_budget,
+            storage=self.storage,
+            shards=shards,
+        ):
+            return False
+
+        self._rescore_cursor += len(shards)
+        if self._rescore_cursor >= len(self.deferred_shards):
+            self._rescore_cursor = 0
+        return True
+
+    def _schedule_retrain(self):
+        # Retraining the ratings that just failed would fail again every tick,
+        # wait for a new rating
+        if self.retrainer.failed_ratings == len(self.rated_items):
+            return
+
+        new_ratings = len(self.rated_items) - self.retrainer.trained_ratings
+        if not self.rescore_needed and new_ratings < self.retrain_every:
+            return
+
+        if self._start_retrain():
+            self.rescore_needed = False
 
     def _rerate(self):
         print("Updating unrated predictions...")
-        self.unrated_items = list(tfidf_score(self.rated_items, self.unrated_items))
+        self.retrainer.wait()
+        self._start_retrain()
+        self.retrainer.wait()
+        self.rescore_needed = False
+        self._swap_scores()
         print("... Done updating unrated predictions")
 
+    @track_usage
+    def budget_report(self, budgets=None):
+        """
+        Compare ranking quality and training time across training budgets
+        """
+        if budgets is None:
+            budgets = [
+                TrainingBudget(),
+                TrainingBudget(max_examples=500, sampling="reservoir"),
+                TrainingBudget(max_examples=500, sampling="stratified"),
+                TrainingBudget(max_examples=2000, sampling="reservoir"),
+                TrainingBudget(max_examples=2000, sampling="stratified"),
+                TrainingBudget(
+                    max_examples=2000, sampling="stratified", half_life=1000
+                ),
+            ]
+            if self.training_budget not in budgets:
+                budgets.append(self.training_budget)
+
+        return budget_report(self.rated_items, budgets)
+
     @track_usage
     def skip(self):
         # TODO skip not implemented
         raise NotImplementedError("skip")
 
     @track_usage
-    def download(self):
+    def download(self, index=None):
+        """
+        Download the active record, or record index of the triage page
+        """
         DOWNLOAD_URL = "https://arxiv.org/pdf/%s.pdf"
 
+        if index is not None:
+            if not 1 <= index <= len(self.triage_page):
+                raise ValueError(
+                    "Record %d isn't on the triage page of %d"
+                    % (index, len(self.triage_page))
+                )
+            record = self.triage_page[index - 1]
+        elif self.active_item is not None:
+            record = self.active_item
+        else:
+            return self._no_active_item()
+
         print("download")
-        print(self.active_item)
-        response = requests.get(DOWNLOAD_URL % self.active_item["id"])
+        print(record)
+        arxiv_id = record["id"]
+        arxiv_id = self.versions.get(canonical_id(arxiv_id), arxiv_id)
+        response = requests.get(DOWNLOAD_URL % arxiv_id)
 
         try:
             mkdir("pdf")
         except FileExistsError:
             pass
 
-        write_out_id = self.active_item["id"]
+        write_out_id = arxiv_id
         write_out_id = write_out_id.replace("/", "__")
         write_out_id += '.pdf'
 
         with open(os.path.join("pdf", write_out_id), "wb") as f:
             f.write(response.content)
 
+    def _no_active_item(self):
+        if self.triage_page:
+            return 'No active record, rate the triage page with rate_batch("1l 2d")'
+        return "No active record, call discover() or explore() first"
+
     def _mark_as_interested(self):
+        if self.active_item is None:
+            return self._no_active_item()
         self.active_item["rating"] = 1
         self.rated_items.append(self.active_item)
         self.store()
@@ -390,6 +951,8 @@ class UserInterface(object):
         return self._tick(store=False)
 
     def _mark_as_read(self):
+        if self.active_item is None:
+            return self._no_active_item()
         self.active_item["rating"] = 2
         self.rated_items.append(self.active_item)
         self.store()
@@ -397,6 +960,8 @@ class UserInterface(object):
         return self._tick(store=False)
 
     def _mark_as_liked(self):
+        if self.active_item is None:
+            return self._no_active_item()
         self.active_item["rating"] = 3
         self.rated_items.append(self.active_item)
         self.store()
@@ -404,6 +969,8 @@ class UserInterface(object):
         return self._tick(store=False)
 
     def _mark_as_disliked(self):
+        if self.active_item is None:
+            return self._no_active_item()
         self.active_item["rating"] = -1
         self.rated_items.append(self.active_item)
         self.store()
@@ -420,9 +987,12 @@ ui = UserInterface(
     ]
 )
 load = ui.load
+load_backlog = ui.load_backlog
 store = ui.store
 discover = ui.discover
 explore = ui.explore
+triage = ui.triage
+rate_batch = ui.rate_batch
 
 i = interested = ui.mark_as_interested
 r = read = ui.mark_as_read
@@ -431,19 +1001,24 @@ s = skip = ui.skip
 d = dislike = ui.mark_as_disliked
 download = ui.download
 stats = ui.stats
+budget = ui.budget_report
 
 operations = [
     ("load", "load saved state"),
+    ("load_backlog", "load the rest of the saved backlog from disk"),
     ("store", "store algorithm state"),
     ("discover", "Surface likely interests based on previous data"),
     ("explore", "Surface random papers"),
+    ("triage", "Show a page of likely interests to rate together"),
+    ("rate_batch", 'Rate the triage page, e.g. rate_batch("1l 2d 3s 4r")'),
     ("i = interested", "Mark as interested and go to the next paper"),
     ("r = read", "Mark that you read the paper and go to the next paper"),
     ("l = liked", "Mark that you read and liked the paper. Go to the next paper"),
     ("s = skip", "Skip the current paper without rating"),
     ("d = dislike", "Dislike the current paper. Recommend less like this"),
-    ("download", "Download the current paper"),
+    ("download", "Download the current paper, or download(n) for the triage page"),
     ("stats", "Print out statistics for the rating system"),
+    ("budget", "Compare ranking quality against training budget"),
 ]
 
 
@@ -471,6 +1046,52 @@ print(
 )
 
 
+def _test_promote():
+    """
+    Evict records that score low to disk, then retrain on ratings that score
+    them above the records kept in memory. The retrain after the next rating
+    has to promote them back
+    """
+    rng = random.Random(0)
+    liked_words = ["liked%d" % i for i in range(30)]
+    other_words = ["other%d" % i for i in range(300)]
+
+    def record(record_id, words, **fields):
+        record = {
+            "id": record_id,
+            "title": record_id,
+            "abstract": " ".join(rng.choice(words) for _ in range(40)),
+            "prng_score": rng.random(),
+            "tfidf_score": 0.0,
+            "citation_score": 0.0,
+        }
+        record.update(fields)
+        return record
+
+    with tempfile.TemporaryDirectory() as path:
+        check = UserInterface([])
+        check.storage = ShardStore(path)
+        check.configure_backlog(backlog_limit=60, spill_batch=5)
+
+        check.rated_items = [
+            record("liked-%d" % i, liked_words + other_words, rating=3)
+            for i in range(30)
+        ] + [record("disliked-%d" % i, other_words, rating=-1) for i in range(30)]
+        check.unrated_items = [
+            record("other-%d" % i, other_words, tfidf_score=0.5) for i in range(80)
+        ] + [record("hidden-%d" % i, liked_words) for i in range(10)]
+
+        # evicts the hidden records and starts a retrain that scores them
+        check.discover(store=False)
+        assert check._deferred_count() == 30
+        check.retrainer.wait()
+
+        check._mark_as_disliked()
+        # and the next eviction spills what they displaced, not them
+        promoted = [r for r in check._backlog() if r["id"].startswith("hidden-")]
+        assert len(promoted) == 10, "%d hidden records promoted" % len(promoted)
+
+
 def test(*, store=False):
     load()
 
@@ -492,6 +1113,11 @@ def test(*, store=False):
     print(liked)
 
     download()
+
+    print(triage(3, store=store))
+    download(1)
+    print(rate_batch("1l 2d 3s"))
+
     stats()
 
     if store:
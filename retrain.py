@@ -0,0 +1,115 @@
+"""
+Retrain the TFIDF model off of the prompt thread
+
+The worker trains on a snapshot of the ratings and scores a snapshot of the
+backlog into a back buffer of {id: tfidf_score}. The UserInterface swaps the
+back buffer in between ticks, so a ranking never mixes old and new scores.
+The worker doesn't print, so it can't interrupt the prompt. Failures are
+reported by swap() on the prompt thread, and failed_ratings holds off retraining
+the same ratings again.
+
+Shards of the backlog that were evicted to disk can be scored along with it.
+They're read in the worker, so the prompt doesn't wait on the disk, and handed
+back scored with the new scores so they can be promoted back into memory.
+"""
+
+import threading
+
+from tfidf import tfidf_score
+
+
+def _snapshot(record):
+    snapshot = {
+        "id": record["id"],
+        "title": record["title"],
+        "abstract": record["abstract"],
+    }
+    if "rating" in record:
+        snapshot["rating"] = record["rating"]
+    return snapshot
+
+
+class RetrainWorker(object):
+    def __init__(self):
+        # number of ratings the front buffer scores were trained on
+        self.trained_ratings = 0
+        # number of ratings the last retrain failed on, None if it succeeded
+        self.failed_ratings = None
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._back_buffer = None
+
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(
+        self, rated_items, unrated_items, *, budget=None, storage=None, shards=()
+    ):
+        """
+        Start training on a snapshot of the records. shards are manifest
+        entries from storage to score too. Returns False without starting if a
+        retrain is already running
+        """
+        if self.busy():
+            return False
+
+        rated_snapshot = [_snapshot(r) for r in rated_items]
+        unrated_snapshot = [_snapshot(r) for r in unrated_items]
+
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(rated_snapshot, unrated_snapshot, budget, storage, list(shards)),
+            name="retrain",
+            daemon=True,
+        )
+        self._thread.start()
+        return True
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, rated_items, unrated_items, budget, storage, shards):
+        try:
+            # Records read here belong to the worker, so they're scored in place
+            rescored = [(entry, storage.read_shard(entry)) for entry in shards]
+            for _, records in rescored:
+                unrated_items.extend(records)
+
+            scores = {
+                r["id"]: r["tfidf_score"]
+                for r in tfidf_score(
+                    rated_items, unrated_items, budget=budget, quiet=True
+                )
+            }
+        except Exception as e:
+            # Reported by swap(), an uncaught exception would print over the prompt
+            with self._lock:
+                self._back_buffer = (len(rated_items), None, None, e)
+            return
+
+        with self._lock:
+            self._back_buffer = (len(rated_items), scores, rescored, None)
+
+    def swap(self):
+        """
+        Take the scores from a finished retrain, or None if there are none.
+        Returns the {id: tfidf_score} scores and a list of (entry, records) for
+        the shards on disk that were scored
+        """
+        with self._lock:
+            finished, self._back_buffer = self._back_buffer, None
+
+        if finished is None:
+            return None
+
+        trained_ratings, scores, rescored, error = finished
+        if error is not None:
+            print("Retrain on %d ratings failed: %r" % (trained_ratings, error))
+            self.failed_ratings = trained_ratings
+            return None
+
+        self.trained_ratings = trained_ratings
+        self.failed_ratings = None
+        return scores, rescored
@@ -0,0 +1,183 @@
+"""
+Sharded on-disk state for the UserInterface
+
+abstract_stream/
+    manifest.json           which shards make up the current state
+    rated-<gen>.bin         every rated record
+    unrated-<gen>-<n>.bin   the backlog in ranked order, BLOCK_SIZE per shard
+    spill-<gen>-<n>.bin     records evicted from the in-memory backlog
+
+Each shard is a sequence of frames, a 4 byte big-endian length followed by a
+zlib compressed msgpack list of records. The manifest lists the ids in each
+unrated shard so the backlog can be deduplicated without reading the shard.
+
+Example manifest
+
+{
+    "version": 1,
+    "rated": {"file": "rated-1700000000000.bin", "count": 1234},
+    "unrated": [
+        {"file": "unrated-1700000000000-0000.bin", "count": 500, "ids": [...]},
+        ...
+    ],
+}
+"""
+
+import json
+import os
+import struct
+import time
+import zlib
+
+import msgpack
+
+STORE_DIR = "abstract_stream"
+LEGACY_PATH = "abstract_stream.json"
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+
+BLOCK_SIZE = 500
+COMPRESSION_LEVEL = 6
+
+_FRAME_HEADER = struct.Struct(">I")
+
+
+def _write_frames(path, records, block_size):
+    with open(path, "wb") as f:
+        for start in range(0, len(records), block_size):
+            block = zlib.compress(
+                msgpack.packb(records[start : start + block_size], use_bin_type=True),
+                COMPRESSION_LEVEL,
+            )
+            f.write(_FRAME_HEADER.pack(len(block)))
+            f.write(block)
+
+
+def _read_frames(path):
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_FRAME_HEADER.size)
+            if not header:
+                break
+            (length,) = _FRAME_HEADER.unpack(header)
+            yield from msgpack.unpackb(zlib.decompress(f.read(length)), raw=False)
+
+
+class ShardStore(object):
+    def __init__(self, path=STORE_DIR, block_size=BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+
+    def _join(self, name):
+        return os.path.join(self.path, name)
+
+    def exists(self):
+        return os.path.exists(self._join(MANIFEST))
+
+    def manifest(self):
+        with open(self._join(MANIFEST), "r") as f:
+            manifest = json.load(f)
+
+        if manifest["version"] != FORMAT_VERSION:
+            raise ValueError(
+                "Unknown abstract_stream format version %r" % (manifest["version"],)
+            )
+        return manifest
+
+    def read_rated(self, manifest):
+        return list(_read_frames(self._join(manifest["rated"]["file"])))
+
+    def read_shard(self, entry):
+        return list(_read_frames(self._join(entry["file"])))
+
+    def write(self, rated_items, unrated_items, deferred_shards=()):
+        """
+        Write a new generation of shards and switch the manifest over to it.
+        deferred_shards are manifest entries for unrated shards that aren't in
+        memory. They're kept as they are, after the in-memory backlog
+        """
+        try:
+            os.mkdir(self.path)
+        except FileExistsError:
+            pass
+
+        generation = time.time_ns()
+
+        rated_name = f"rated-{generation}.bin"
+        _write_frames(self._join(rated_name), rated_items, self.block_size)
+
+        unrated_entries = self._write_shards(unrated_items, f"unrated-{generation}")
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "rated": {"file": rated_name, "count": len(rated_items)},
+            "unrated": unrated_entries + list(deferred_shards),
+        }
+
+        # Swap the manifest in last so a failed store leaves the old state intact
+        temp_path = self._join(MANIFEST + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self._join(MANIFEST))
+
+        self._remove_unreferenced(manifest)
+
+        return manifest
+
+    def spill(self, records):
+        """
+        Write records evicted from memory to new shards. The returned manifest
+        entries have to be passed to the next write() to be kept
+        """
+        try:
+            os.mkdir(self.path)
+        except FileExistsError:
+            pass
+
+        return self._write_shards(records, f"spill-{time.time_ns()}")
+
+    def _write_shards(self, records, prefix):
+        entries = []
+        for shard_index, start in enumerate(range(0, len(records), self.block_size)):
+            block = records[start : start + self.block_size]
+            name = f"{prefix}-{shard_index:04d}.bin"
+            _write_frames(self._join(name), block, self.block_size)
+            entries.append(
+                {"file": name, "count": len(block), "ids": [r["id"] for r in block]}
+            )
+        return entries
+
+    def _remove_unreferenced(self, manifest):
+        referenced = {manifest["rated"]["file"]}
+        referenced.update(entry["file"] for entry in manifest["unrated"])
+
+        for name in os.listdir(self.path):
+            if name.endswith(".bin") and name not in referenced:
+                os.remove(self._join(name))
+
+
+def read_legacy(legacy_path=LEGACY_PATH):
+    with open(legacy_path, "r") as f:
+        py_version = json.load(f)
+
+    return py_version["rated_items"], py_version["unrated_items"]
+
+
+def migrate(legacy_path=LEGACY_PATH, store=None):
+    """
+    Convert a single document abstract_stream.json into shards. The json file
+    is left in place, the shards take precedence once they exist
+    """
+    if store is None:
+        store = ShardStore()
+
+    rated_items, unrated_items = read_legacy(legacy_path)
+    manifest = store.write(rated_items, unrated_items)
+    print(
+        f"Migrated {len(rated_items)} ratings and {len(unrated_items)} unrated records from {legacy_path} to {store.path}"
+    )
+    return manifest
+
+
+if __name__ == "__main__":
+    migrate()
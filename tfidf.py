@@ -16,49 +16,153 @@ Example Rated Item
 
 import numpy as np
 
+import random
 from time import time
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import Ridge
 
 Dataset = namedtuple(
-    "Dataset", ["data", "target", "filenames", "DESCR", "target_names"]
+    "Dataset",
+    ["data", "target", "filenames", "DESCR", "target_names", "sample_weight"],
+    defaults=(None,),
 )
 
+"""
+Limits on the rating history used to train the model
+
+max_examples: cap on the number of training examples, None for no cap
+sampling: "reservoir" for a uniform sample over the history or "stratified" for
+    an even share of the cap per rating level
+half_life: weight ratings by recency, halving the weight of a rating for every
+    half_life ratings given after it. None for uniform weights
+seed: seed for the sampling and resampling, so repeated retrains select a
+    stable sample
+"""
+TrainingBudget = namedtuple(
+    "TrainingBudget",
+    ["max_examples", "sampling", "half_life", "seed"],
+    defaults=(None, "reservoir", None, 0),
+)
+
+
+def _reservoir(indices, size, rng):
+    """
+    Algorithm R. Sampling the same history with the same seed keeps the sample
+    of earlier ratings as new ratings are appended
+    """
+    reservoir = []
+    for seen, idx in enumerate(indices):
+        if seen < size:
+            reservoir.append(idx)
+        else:
+            replace = rng.randint(0, seen)
+            if replace < size:
+                reservoir[replace] = idx
+    return reservoir
+
+
+def _stratified(rated_items, size, rng):
+    levels = defaultdict(list)
+    for idx, item in enumerate(rated_items):
+        levels[item["rating"]].append(idx)
+
+    # Give each level an even share, then hand out what small levels don't use
+    shares = {level: 0 for level in levels}
+    remaining = size
+    while remaining > 0:
+        open_levels = [
+            level for level in levels if shares[level] < len(levels[level])
+        ]
+        if not open_levels:
+            break
+        share = max(remaining // len(open_levels), 1)
+        for level in open_levels:
+            grant = min(share, len(levels[level]) - shares[level], remaining)
+            shares[level] += grant
+            remaining -= grant
+
+    selected = []
+    for level, indices in levels.items():
+        selected.extend(_reservoir(indices, shares[level], rng))
+    return sorted(selected)
+
+
+def select_training_items(rated_items, budget=None):
+    """
+    Apply a TrainingBudget to the rating history (oldest rating first). Returns
+    the selected items and their sample weights (None for uniform weights)
+    """
+    if budget is None:
+        budget = TrainingBudget()
+
+    indices = list(range(len(rated_items)))
+    if budget.max_examples is not None and len(indices) > budget.max_examples:
+        rng = random.Random(budget.seed)
+        if budget.sampling == "reservoir":
+            indices = sorted(_reservoir(indices, budget.max_examples, rng))
+        elif budget.sampling == "stratified":
+            indices = _stratified(rated_items, budget.max_examples, rng)
+        else:
+            raise ValueError("Unknown sampling %r" % (budget.sampling,))
+
+    selected = [rated_items[idx] for idx in indices]
+
+    if budget.half_life is None:
+        return selected, None
+
+    newest = len(rated_items) - 1
+    weights = [0.5 ** ((newest - idx) / budget.half_life) for idx in indices]
+    return selected, weights
+
+
+def _item_text(item):
+    return item["title"] + "   " + item["abstract"]
+
 
-def _items_to_dataset(items, *, resample=False):
+def _items_to_dataset(
+    items, *, resample=False, weights=None, seed=None, quiet=False
+):
     positive_data = []  # list of strings
     positive_target = []  # list of float scores to predict
+    positive_weight = []
     negative_data = []
     negative_target = []
+    negative_weight = []
+
+    if weights is None:
+        weights = [1.0] * len(items)
 
     target_names = []  # list of target classes
 
-    for i in items:
+    for i, weight in zip(items, weights):
         # ((-1) + 1) / 4 -> 0.00 # dislike
         # (( 0) + 1) / 4 -> 0.25
         # ((+1) + 1) / 4 -> 0.50 # interested
         # ((+2) + 1) / 4 -> 0.75 # read
         # ((+3) + 1) / 4 -> 1.00 # liked
-        text = i["title"] + "   " + i["abstract"]
+        text = _item_text(i)
 
         if "rating" in i:
             rating = i["rating"]
             if rating <= 0:
                 negative_data.append(text)
                 negative_target.append((rating + 1.0) / 4.0)
+                negative_weight.append(weight)
             else:
                 positive_data.append(text)
                 positive_target.append((rating + 1.0) / 4.0)
+                positive_weight.append(weight)
         else:
             if resample:
                 raise ValueError("Can't resample without ratings")
             negative_data.append(text)
             negative_target.append("no score")
+            negative_weight.append(weight)
 
     if resample:
-        reselect_idx = np.random.randint(
+        reselect_idx = np.random.RandomState(seed).randint(
             0, len(positive_data), size=(len(negative_data),)
         )
 
@@ -66,18 +170,21 @@ def _items_to_dataset(items, *, resample=False):
 
         positive_data = np.array(positive_data)[reselect_idx]
         positive_target = np.array(positive_target)[reselect_idx]
+        positive_weight = np.array(positive_weight)[reselect_idx]
 
         post_size = len(positive_data)
-        print(
-            "Resampled from %d to %d"
-            % (
-                pre_size,
-                post_size,
+        if not quiet:
+            print(
+                "Resampled from %d to %d"
+                % (
+                    pre_size,
+                    post_size,
+                )
             )
-        )
 
     data = np.concatenate((negative_data, positive_data))
     target = np.concatenate((negative_target, positive_target))
+    sample_weight = np.concatenate((negative_weight, positive_weight))
 
     return Dataset(
         data=np.array(data),
@@ -85,12 +192,52 @@ def _items_to_dataset(items, *, resample=False):
         filenames=[],
         DESCR="auto",
         target_names=target_names,
+        sample_weight=sample_weight,
     )
 
 
-def _load_dataset(rated_items, unrated_items, *, verbose=False, max_df=0.5, min_df=5):
-    data_train = _items_to_dataset(rated_items, resample=True)
-    data_test = _items_to_dataset(unrated_items)
+"""
+rows: number of training rows the model was fit on, after sampling and
+    resampling
+"""
+Model = namedtuple("Model", ["vectorizer", "clf", "rows"])
+
+
+def fit(
+    rated_items,
+    *,
+    verbose=False,
+    max_df=0.5,
+    min_df=5,
+    tol=1e-2,
+    solver="sparse_cg",
+    budget=None,
+    quiet=False,
+):
+    """
+    Train the TFIDF vectorizer and Ridge regression on the rated items
+    (oldest rating first). budget is an optional TrainingBudget limiting which
+    ratings are used to train. quiet skips all printing
+    """
+    if budget is None:
+        budget = TrainingBudget()
+
+    train_items, train_weights = select_training_items(rated_items, budget)
+
+    # A stratified sample is already balanced across the rating levels, and
+    # resampling the positives to the negatives would undo it
+    stratified = (
+        budget.sampling == "stratified"
+        and budget.max_examples is not None
+        and len(rated_items) > budget.max_examples
+    )
+    data_train = _items_to_dataset(
+        train_items,
+        resample=not stratified,
+        weights=train_weights,
+        seed=budget.seed,
+        quiet=quiet,
+    )
     """
     data_train should match:
 
@@ -109,9 +256,6 @@ def _load_dataset(rated_items, unrated_items, *, verbose=False, max_df=0.5, min_
             The names of target classes.
             """
 
-    target_names = data_train.target_names
-    y_train = data_train.target
-
     t0 = time()
     vectorizer = TfidfVectorizer(
         sublinear_tf=True, max_df=max_df, min_df=min_df, stop_words="english"
@@ -119,58 +263,124 @@ def _load_dataset(rated_items, unrated_items, *, verbose=False, max_df=0.5, min_
     X_train = vectorizer.fit_transform(data_train.data)
     duration_train = time() - t0
 
-    t0 = time()
-    X_test = vectorizer.transform(data_test.data)
-    duration_test = time() - t0
-
-    feature_names = vectorizer.get_feature_names_out()
-
     if verbose:
+        print(f"{len(train_items)} of {len(rated_items)} ratings used for training")
         print(f"{len(data_train.data)} documents - (training set)")
-        print(f"{len(data_test.data)} documents - (test set)")
-        print(f"{len(target_names)} categories")
+        print(f"{len(data_train.target_names)} categories")
         print(f"vectorize training done in {duration_train:.3f}s ")
         print(f"n_samples: {X_train.shape[0]}, n_features: {X_train.shape[1]}")
+
+    clf = Ridge(tol=tol, solver=solver)
+    clf.fit(X_train, data_train.target, sample_weight=data_train.sample_weight)
+
+    return Model(vectorizer=vectorizer, clf=clf, rows=len(data_train.data))
+
+
+def predict(model, items, *, verbose=False):
+    """
+    Predict the rating of each item on a 0 to 1 scale, in the order of items
+    """
+    t0 = time()
+    X_test = model.vectorizer.transform([_item_text(i) for i in items])
+    duration_test = time() - t0
+
+    if verbose:
+        print(f"{len(items)} documents - (test set)")
         print(f"vectorize testing done in {duration_test:.3f}s ")
         print(f"n_samples: {X_test.shape[0]}, n_features: {X_test.shape[1]}")
 
-    return X_train, y_train, X_test, feature_names, target_names
+    return model.clf.predict(X_test)
 
 
-def tfidf_score(rated_items, unrated_items, *, verbose=False, test=False):
+def tfidf_score(
+    rated_items, unrated_items, *, verbose=False, test=False, budget=None, quiet=False
+):
     """
     Given a list of rated items (title, abstract, rating), predict the rating
     on a 0 to 1 scale, assign to tfidf_score and return the unrated items with
     updated tfidf_score
+
+    rated_items are expected oldest rating first. budget is an optional
+    TrainingBudget limiting which ratings are used to train. quiet skips all
+    printing, for training off of the prompt thread
     """
     if not test:
-        X_train, y_train, X_test, feature_names, target_names = _load_dataset(
-            rated_items=rated_items,
-            unrated_items=unrated_items,
-            verbose=verbose,
-        )
+        vectorizer_args = {}
     else:
-        X_train, y_train, X_test, feature_names, target_names = _load_dataset(
-            rated_items=rated_items,
-            unrated_items=unrated_items,
-            verbose=verbose,
-            max_df=0.99,
-            min_df=0.01,
-        )
+        vectorizer_args = {"max_df": 0.99, "min_df": 0.01}
 
-    clf = Ridge(tol=1e-2, solver="sparse_cg")
-    print("y_train", y_train, y_train.shape)
-    clf.fit(X_train, y_train)
-    y_pred = clf.predict(X_test)
+    verbose = verbose and not quiet
+    model = fit(
+        rated_items, verbose=verbose, budget=budget, quiet=quiet, **vectorizer_args
+    )
+    y_pred = predict(model, unrated_items, verbose=verbose)
 
-    print("y_pred", y_pred.shape)
-    print("unrated_items", len(unrated_items))
+    if not quiet:
+        print("y_pred", y_pred.shape)
+        print("unrated_items", len(unrated_items))
 
     for item, score in zip(unrated_items, y_pred):
         item["tfidf_score"] = score
         yield item
 
 
+def _pairwise_accuracy(ratings, scores):
+    """
+    Fraction of pairs with different ratings that the scores put in the same
+    order as the ratings
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+
+    rating_order = np.sign(ratings[:, None] - ratings[None, :])
+    score_order = np.sign(scores[:, None] - scores[None, :])
+
+    compared = rating_order != 0
+    if not compared.any():
+        return float("nan")
+    return float((rating_order == score_order)[compared].mean())
+
+
+def budget_report(rated_items, budgets, *, holdout=0.2):
+    """
+    Train on the older ratings with each budget and rank the most recent
+    ratings, reporting ranking quality against training time. examples is the
+    number of rows fit, after sampling and resampling
+    """
+    split = int(len(rated_items) * (1.0 - holdout))
+    history, recent = rated_items[:split], rated_items[split:]
+
+    print(f"Training on {len(history)} ratings, evaluating {len(recent)} ratings")
+    print(
+        "budget".ljust(60),
+        "examples".rjust(8),
+        "fit sec".rjust(8),
+        "pair acc".rjust(8),
+    )
+
+    # Without their ratings, so the held out items stay in order
+    unrated = [{k: v for k, v in i.items() if k != "rating"} for i in recent]
+
+    results = []
+    for budget in budgets:
+        t0 = time()
+        model = fit(history, budget=budget, quiet=True)
+        scores = predict(model, unrated)
+        duration = time() - t0
+
+        accuracy = _pairwise_accuracy([i["rating"] for i in recent], scores)
+        examples = model.rows
+        results.append((budget, examples, duration, accuracy))
+        print(
+            str(budget).ljust(60),
+            f"{examples:8d}",
+            f"{duration:8.3f}",
+            f"{accuracy:8.3f}",
+        )
+
+    return results
+
+
 def _test_ratings():
     return [
         {
@@ -219,6 +429,23 @@ def _test():
 
     assert rerated[0]["tfidf_score"] < rerated[1]["tfidf_score"]
 
+    selected, weights = select_training_items(
+        _test_ratings(),
+        TrainingBudget(max_examples=2, sampling="stratified", half_life=1),
+    )
+    assert len(selected) == 2
+    assert len(set(i["rating"] for i in selected)) == 2
+    assert weights[-1] <= 1.0
+
+    model = fit(
+        _test_ratings(),
+        max_df=1.0,
+        min_df=0.01,
+        budget=TrainingBudget(max_examples=2, sampling="stratified"),
+        quiet=True,
+    )
+    assert model.rows == 2
+
 
 if __name__ == "__main__":
     _test()